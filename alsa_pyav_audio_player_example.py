@@ -6,50 +6,96 @@ For eg.:
 """
 
 import sys
-from time import sleep
+import threading
 from audio_player_base.alsa import AlsaAudioPlayer
 from audio_player_base.pyav import PyAVPlayObject
 
+# Set when the playback is over (end of queue, 'q' command ...)
+stop_event = threading.Event()
+
 
 class MyAudioPlayer(AlsaAudioPlayer):
     PlayObjectClass = PyAVPlayObject
 
+    def _on_playback_stopped(self):
+        stop_event.set()
+
     def _notify_progression(self, context):
         """Regularly called, for example to update a progress bar"""
-        current_percent_pos = self.play_object.get_percentage_pos()
-        total_duration_seconds = self.play_object.duration
+        try:
+            # duration does not change during a track: cache it (and
+            # the percent->seconds factor) in the per-track context
+            total_duration_seconds, factor = context['duration']
+        except KeyError:
+            total_duration_seconds = self.play_object.duration
+            factor = total_duration_seconds / 100. \
+                if total_duration_seconds else None
+            context['duration'] = (total_duration_seconds, factor)
         if not total_duration_seconds:
             return
-        current_pos_seconds = int(current_percent_pos / 100. * total_duration_seconds)
-        print(" {:.1f}% (-{:d}s)".
-              format(current_percent_pos,
-                     total_duration_seconds - current_pos_seconds))
+        # pos_sec is maintained by the base class from a sample
+        # counter, so the decoder is not queried on every tick
+        pos_seconds = context.get('pos_sec')
+        if pos_seconds is None:
+            pos_seconds = self.play_object.get_percentage_pos() * factor
+        current_percent_pos = pos_seconds / factor
+        # Subtract the buffered-audio delay so that the displayed
+        # position matches what is heard, not what is decoded
+        current_pos_seconds = max(0, int(pos_seconds -
+                                         self.playback_delay_seconds()))
+        print(" %.1f%% (-%ds)" % (current_percent_pos,
+                                  total_duration_seconds -
+                                  current_pos_seconds))
 
 if __name__ == '__main__':
     player = MyAudioPlayer(default_files_dir='.',
                            removed_files_backup_dir='./music_trash',
                            notify_progression_interval=1.0)
     player.play(queue=sys.argv[1:], shuffle=True)
+    if player.status == "stopped":
+        # play() refused to start (e.g. empty queue): the play thread
+        # was never launched, so _on_playback_stopped will not fire
+        stop_event.set()
 
-    cmd2action = {
-        ' ': player.play_pause,
-        's': lambda: player.seek(95),
-        'n': player.play_next,
-        'p': player.play_prev,
-        'r': lambda: player.seek(0),
-        'd': lambda: player.remove_current(backup=True),
-        'q': player.stop,
-    }
+    def quit():
+        # stop() on an already-stopped player does not fire
+        # _on_playback_stopped either, so always release the main
+        # thread here
+        player.stop()
+        stop_event.set()
 
-    try:
-        while player.status != 'stopped':
-            sleep(1)
-            r = input()
-            action = cmd2action.get(r)
+    # Dispatch table for the single-char commands: a 128-entry list
+    # indexed by ord(char), so dispatching a keystroke is a plain
+    # list index instead of a dict lookup
+    dispatch = [None] * 128
+    dispatch[ord(' ')] = player.play_pause
+    dispatch[ord('s')] = lambda: player.seek(95)
+    dispatch[ord('n')] = player.play_next
+    dispatch[ord('p')] = player.play_prev
+    dispatch[ord('r')] = lambda: player.seek(0)
+    dispatch[ord('d')] = lambda: player.remove_current(backup=True)
+    dispatch[ord('q')] = quit
+
+    def stdin_reader():
+        """Dispatch the commands typed on stdin (no polling)."""
+        for line in sys.stdin:
+            r = line.strip('\n')
+            action = None
+            if len(r) == 1 and ord(r) < 128:
+                action = dispatch[ord(r)]
             if action is not None:
                 action()
             else:
                 # Maybe a search query like '#recent' ?
                 player.search_and_play(r)
+        stop_event.set()
+
+    reader_thread = threading.Thread(target=stdin_reader)
+    reader_thread.daemon = True
+    reader_thread.start()
+
+    try:
+        # Sleep until the playback is over, without any periodic wakeup
+        stop_event.wait()
     except KeyboardInterrupt:
         player.stop()
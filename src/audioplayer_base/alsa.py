@@ -5,16 +5,22 @@ python alsaaudio package).
 To be usable, a :attr:`PlayObjectClass` must be set
 on :class:`AlsaAudioPlayer`.
 """
+import os
+import select
+from threading import Thread, Event
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    # Python < 3
+    from Queue import Queue, Empty
+
 import alsaaudio as aa
 
 from .interface import log, AudioPlayerInterface
 
 __all__ = ('AlsaAudioPlayer',)
 
-try:
-    log.debug("Available ALSA mixers : %s", aa.mixers())
-except:
-    log.exception("failed to get alsaaudio mixers")
 
 class AlsaAudioPlayer(AudioPlayerInterface):
     """
@@ -28,28 +34,340 @@ class AlsaAudioPlayer(AudioPlayerInterface):
     #: If not specified, the first available mixer name is taken.
     mixer_name = None
 
+    #: Maximum number of decoded PCM chunks that can be pending in the
+    #: queue feeding the writer thread (so roughly that many periods of
+    #: pre-buffered audio).
+    pcm_queue_size = 8
+
+    @property
+    def write_pipeline_depth(self):
+        # Chunks queued towards the writer thread may still reference
+        # the play loop's reusable read buffers (see
+        # AudioPlayerInterface). A property rather than a class-body
+        # snapshot: it must follow pcm_queue_size when a subclass
+        # tunes it, or the buffer pool ends up smaller than the number
+        # of chunks in flight
+        return self.pcm_queue_size
+
     def __init__(self, *args, **kwargs):
-        # Alsa mixer for volume control
-        if not self.mixer_name:
-            mixers = aa.mixers()
-            if not mixers:
-                raise Exception("No available alsaaudio mixers")
-            self.mixer_name = mixers[0]
-            log.debug("Using the first available alsaaudio mixer %r",
-                      self.mixer_name)
-        self.mixer = aa.Mixer(self.mixer_name)
-        log.debug("mixer is %r", self.mixer.mixer())
+        # Alsa mixer for volume control, lazily created on first use
+        # (see the :attr:`.mixer` property), so that instantiating the
+        # player does not scan the sound cards
+        self._mixer = None
         self.output = None
-        self._output_params = (None, None, None)
+        self._output_params = (None, None, None, None)
+        # Queue of decoded PCM chunks consumed by the writer thread
+        # (created when the output is opened)
+        self._pcm_queue = None
+        self._writer_thread = None
+        # Accumulator coalescing sub-period data into full alsa periods
+        self._accum = bytearray()
+        self._period_bytes = None
+        # Volume requested by _do_set_volume but not yet pushed to the
+        # mixer (applied between two periods by the writer thread while
+        # playing, so the mixer syscall never delays a caller)
+        self._pending_volume = None
+        self._applied_volume = None
+        # Cleared by _do_play_pause while paused: the writer thread
+        # pauses the pcm and waits on it between two chunks, so the
+        # queued periods do not play out after a pause request
+        self._writer_resume = Event()
+        self._writer_resume.set()
         super(AlsaAudioPlayer, self).__init__(*args, **kwargs)
 
+    @property
+    def mixer(self):
+        """
+        The alsa mixer used for volume control
+        (created on first access).
+        """
+        if self._mixer is None:
+            if not self.mixer_name:
+                mixers = aa.mixers()
+                if not mixers:
+                    raise Exception("No available alsaaudio mixers")
+                self.mixer_name = mixers[0]
+                log.debug("Using the first available alsaaudio mixer %r",
+                          self.mixer_name)
+            self._mixer = aa.Mixer(self.mixer_name)
+            log.debug("mixer is %r", self._mixer.mixer())
+        return self._mixer
+
     def _do_open_output(self):
         """
         Open the alsa output audio interface, before playing the track queue.
+
+        Also starts the writer thread which performs the (blocking) alsa
+        writes, so that decoding hiccups and alsa period deadlines are
+        decoupled by the pcm queue.
         """
         log.debug("Open alsa audio output")
-        self.output = aa.PCM(aa.PCM_PLAYBACK, aa.PCM_NORMAL)
-        self.output.setformat(aa.PCM_FORMAT_S16_LE)
+        # Non-blocking mode: write() returns 0 when the ring buffer is
+        # full, and we then wait on the pcm poll descriptors instead of
+        # being blocked (or spinning) inside alsa
+        try:
+            # Request an explicit ring buffer of 2 periods right away,
+            # so that playback starts as soon as the first period is
+            # queued instead of whatever default the driver picked (a
+            # known source of startup underruns). The hardware params
+            # can only be chosen at PCM creation (pyalsaaudio >= 0.9
+            # keyword); older versions keep the driver default.
+            self.output = aa.PCM(aa.PCM_PLAYBACK, aa.PCM_NONBLOCK,
+                                 periods=2)
+        except TypeError:
+            log.debug("pyalsaaudio does not accept periods=, "
+                      "keeping the driver default buffer size")
+            self.output = aa.PCM(aa.PCM_PLAYBACK, aa.PCM_NONBLOCK)
+        # (the sample format is set by _do_configure_output_for_current_track)
+        self._poll_fds = None  # lazily fetched pcm poll descriptors
+        # _do_open_output runs on the play (decoder) thread: pin it
+        # to its own CPU, the writer thread pins itself to a peer
+        self._pin_thread_to_cpu(0)
+        self._pcm_queue = Queue(maxsize=self.pcm_queue_size)
+        # Bind the queue put once: _do_write_data_chunk runs once per
+        # audio chunk on the play thread
+        self._pcm_put = self._pcm_queue.put
+        self._writer_thread = t = Thread(target=self._writer_loop)
+        t.daemon = True
+        t.start()
+
+    def _writer_loop(self):
+        """
+        Consume the decoded PCM chunks from the queue and write them to
+        the alsa output. (Run in the writer thread started
+        by :meth:`._do_open_output`, until a ``None`` sentinel is received)
+        """
+        log.debug("alsa writer thread started")
+        self._pin_thread_to_cpu(1)
+        self._raise_writer_priority()
+        pcm_queue_get = self._pcm_queue.get
+        # Every queued chunk is accounted as a task, so that
+        # _drain_writer can join() the queue to wait until the writer
+        # has gone idle (no pending chunk and no write in flight)
+        task_done = self._pcm_queue.task_done
+        while True:
+            data = pcm_queue_get()
+            if data is None:
+                # sentinel pushed by _do_close_output
+                task_done()
+                break
+            if not self._writer_resume.is_set():
+                self._pause_output_and_wait()
+            # Volume changes are coalesced here, between two periods
+            self._apply_pending_volume()
+            self._write_chunk(data)
+            task_done()
+        log.debug("alsa writer thread finished")
+
+    def _pin_thread_to_cpu(self, which):
+        """
+        Pin the calling thread to a stable CPU (``which`` is 0 for the
+        decoder/play thread, 1 for the writer thread), so the pcm queue
+        cache lines stay warm in each core instead of following thread
+        migrations. No-op on single-CPU hosts or where
+        ``sched_setaffinity`` is unavailable.
+        """
+        try:
+            cpu_count = os.cpu_count() or 1
+        except AttributeError:
+            return
+        if cpu_count < 2:
+            return
+        # use the two last CPUs, the first ones are usually the
+        # busiest (interrupts, system threads ...)
+        cpu = cpu_count - 2 + which
+        try:
+            os.sched_setaffinity(0, {cpu})
+            log.debug("thread pinned to cpu %s", cpu)
+        except (AttributeError, OSError):
+            pass
+
+    def _raise_writer_priority(self):
+        """
+        Try to put the writer thread in the SCHED_FIFO real-time class
+        so that ordinary threads cannot preempt it past an alsa period
+        deadline. This needs CAP_SYS_NICE (or a suitable ``ulimit -r``);
+        without it we fall back to a better nice level, and silently
+        keep the default scheduling if even that is refused.
+        """
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(50))
+        except AttributeError:
+            # Python < 3.3 or non-Linux: no sched_setscheduler
+            pass
+        except OSError:
+            try:
+                os.nice(-10)
+                log.debug("writer thread: SCHED_FIFO refused, "
+                          "using nice -10")
+            except OSError:
+                log.debug("writer thread: cannot raise priority "
+                          "(missing CAP_SYS_NICE)")
+        else:
+            log.debug("writer thread set to SCHED_FIFO")
+
+    def _write_chunk(self, data):
+        """
+        Write one PCM chunk to the non-blocking alsa output, waiting on
+        its poll descriptors when the ring buffer is full, and
+        recovering from underruns (-EPIPE) by reconfiguring the pcm.
+        """
+        output = self.output
+        write = output.write  # hoisted: called once per chunk
+        while True:
+            try:
+                n = write(data)
+            except aa.ALSAAudioError as e:
+                # Underrun: the pcm is in XRUN state, reapply the
+                # current config to get it prepared again, then retry
+                log.warning("alsa write error (underrun ?): %r", e)
+                try:
+                    self._reapply_output_params()
+                except aa.ALSAAudioError:
+                    # Keep the writer thread alive whatever happens:
+                    # the play thread blocks on the pcm queue and
+                    # would hang forever without its consumer
+                    log.exception("alsa recovery failed, "
+                                  "dropping one chunk")
+                    return
+                continue
+            if n:
+                break
+            # The alsa ring buffer is full, wait until there is room
+            # for a period instead of retrying immediately
+            fds = self._poll_fds
+            if fds is None:
+                try:
+                    # Fetch the descriptors once per output open: they
+                    # do not change for the lifetime of the pcm handle
+                    fds = [fd for fd, _ in output.polldescriptors()]
+                except Exception:
+                    # polldescriptors may not be available, fall back
+                    # to letting write() retry
+                    fds = []
+                self._poll_fds = fds
+            if fds:
+                select.select([], fds, [], 0.1)
+
+    def _pause_output_and_wait(self):
+        """
+        Pause the pcm and sleep until :meth:`._do_play_pause` (or a
+        stop) wakes the writer up, then resume it. Runs on the writer
+        thread, between two chunks: the pause cycle never races a
+        concurrent write on the (non thread-safe) pcm handle, and the
+        frames already handed to alsa stop within the period being
+        written instead of after the whole queued backlog.
+        """
+        output = self.output
+        try:
+            output.pause(1)
+        except aa.ALSAAudioError as e:
+            log.warning("failed to pause alsa output: %r", e)
+        self._writer_resume.wait()
+        try:
+            output.pause(0)
+        except aa.ALSAAudioError as e:
+            log.warning("failed to resume alsa output: %r", e)
+
+    def _do_play_pause(self):
+        """
+        Pause or resume the writer thread (called by
+        :meth:`.play_pause`, before the status is toggled). Without
+        this the ~:attr:`.pcm_queue_size` periods already queued would
+        keep playing after a pause request.
+        """
+        if self.status == "playing":
+            # pausing: the writer pauses the pcm between two chunks
+            self._writer_resume.clear()
+        else:
+            # resuming
+            self._writer_resume.set()
+
+    def _do_stop(self):
+        """
+        Stop the current playing track if any.
+        (Called by :meth:`.stop`)
+        """
+        super(AlsaAudioPlayer, self)._do_stop()
+        # Discard the queued chunks instead of letting them play out:
+        # otherwise stop() blocks on the play thread join while
+        # ~pcm_queue_size periods of stale audio are still written
+        pcm_queue = self._pcm_queue
+        if pcm_queue is not None:
+            try:
+                while True:
+                    pcm_queue.get_nowait()
+                    pcm_queue.task_done()
+            except Empty:
+                pass
+        # Wake the writer if it was paused, so that it can consume the
+        # sentinel pushed by _do_close_output
+        self._writer_resume.set()
+
+    def _reapply_output_params(self):
+        """
+        Re-apply the cached output config to the pcm, to get it
+        prepared again after an underrun.
+
+        Runs on the writer thread: unlike
+        :meth:`._do_configure_output_for_current_track` it must not
+        touch the period accumulator, the pcm queue or the play
+        object, which belong to the play thread (and flushing the
+        accumulator here would deadlock: the writer is the queue's
+        only consumer).
+        """
+        n_channels, sample_rate, chunk_size, pcm_format = \
+            self._output_params
+        if n_channels is None:
+            # output was never configured
+            return
+        output = self.output
+        output.setformat(pcm_format)
+        output.setchannels(n_channels)
+        output.setrate(sample_rate)
+        output.setperiodsize(chunk_size)
+
+    def _do_flush_output(self):
+        """
+        Discard the audio buffered ahead of the playback position:
+        the pending pcm queue chunks, the period accumulator and the
+        frames already handed to alsa. (Called after a seek)
+        """
+        pcm_queue = self._pcm_queue
+        if pcm_queue is not None:
+            try:
+                while True:
+                    pcm_queue.get_nowait()
+                    pcm_queue.task_done()
+            except Empty:
+                pass
+        del self._accum[:]
+        output = self.output
+        if output is not None:
+            # Let a possible in-flight write finish first: the pause
+            # cycle must not race a concurrent write on the single
+            # (non thread-safe) pcm handle
+            self._drain_writer()
+            try:
+                # A pause/unpause cycle drops the pending frames while
+                # keeping the pcm prepared with its current config,
+                # which is orders of magnitude cheaper than a
+                # close/reopen (full snd_pcm_hw_params reinit)
+                output.pause(1)
+                output.pause(0)
+            except aa.ALSAAudioError as e:
+                log.warning("failed to flush alsa output: %r", e)
+
+    def _drain_writer(self):
+        """
+        Wait until the writer thread has written every queued chunk
+        and gone idle. Called by the play thread before operations
+        that must not run concurrently with a write on the pcm handle
+        (hw param changes, the flush pause cycle).
+        """
+        pcm_queue = self._pcm_queue
+        if pcm_queue is not None and self._writer_thread is not None:
+            pcm_queue.join()
 
     def _do_configure_output_for_current_track(self):
         """
@@ -59,11 +377,29 @@ class AlsaAudioPlayer(AudioPlayerInterface):
         play_object = self.play_object
         audio_chunk_size = self.audio_chunk_size
 
-        current_n_channels, current_sample_rate, current_chunk_size = \
-            self._output_params
-        new_n_channels, new_sample_rate, new_chunk_size = \
-            play_object.num_channels, play_object.sample_rate, audio_chunk_size
+        # Flush the (sub-period) tail of the previous track before
+        # possibly changing the output config
+        self._flush_accum()
+
+        current_n_channels, current_sample_rate, current_chunk_size, \
+            current_format = self._output_params
+        new_n_channels, new_sample_rate, new_chunk_size, new_format = (
+            play_object.num_channels, play_object.sample_rate,
+            audio_chunk_size, aa.PCM_FORMAT_S16_LE)
+
+        if (new_n_channels, new_sample_rate, new_chunk_size,
+                new_format) != self._output_params:
+            # The previous track's queued tail must be fully written
+            # before the hw params change: it has to play at the old
+            # configuration, and the alsaaudio handle is not
+            # thread-safe against the writer's concurrent write()
+            self._drain_writer()
 
+        # Each snd_pcm_hw_params call costs ~ms and can drain the dma
+        # buffer, so only touch the settings that actually changed
+        # since the previous track
+        if new_format != current_format:
+            output.setformat(new_format)
         if new_n_channels != current_n_channels:
             output.setchannels(new_n_channels)
         if new_sample_rate != current_sample_rate:
@@ -71,13 +407,25 @@ class AlsaAudioPlayer(AudioPlayerInterface):
         if new_chunk_size != current_chunk_size:
             output.setperiodsize(new_chunk_size)
 
-        self._output_params = (new_n_channels, new_sample_rate, new_chunk_size)
-        log.info("ALSA output config: %s %s %s" % self._output_params)
+        self._output_params = (new_n_channels, new_sample_rate,
+                               new_chunk_size, new_format)
+        # One alsa period in bytes (16-bit samples)
+        self._period_bytes = new_chunk_size * new_n_channels * 2
+        log.info("ALSA output config: %s %s %s (format %s)",
+                 *self._output_params)
 
     def _do_close_output(self):
         """
         Close the alsa output audio interface.
         """
+        if self._writer_thread is not None:
+            # Ask the writer thread to finish, after it has drained the
+            # pending chunks
+            self._flush_accum()
+            self._pcm_queue.put(None)
+            self._writer_thread.join()
+            self._writer_thread = None
+            self._pcm_queue = None
         if self.output is not None:
             log.debug("closing alsa audio output")
             self.output.close()
@@ -87,19 +435,86 @@ class AlsaAudioPlayer(AudioPlayerInterface):
 
     def _do_write_data_chunk(self, data, context):
         """
-        Directly writes given data to the alsa output.
-        (called by :meth:`._do_play_queue`)
+        Push the given data to the queue consumed by the writer thread.
+        (called by :meth:`._do_play_queue`; blocks when the queue is
+        full, which gives backpressure to the decoding loop)
 
         :param context: A play context ``dict`` that is specific
             to the current played track.
         """
-        self.output.write(data)
+        accum = self._accum
+        period_bytes = self._period_bytes
+        if not accum and len(data) == period_bytes:
+            # Fast path: the decoder handed exactly one period
+            # (the common case, since the play loop reads
+            # audio_chunk_size frames at a time)
+            self._pcm_put(data)
+            return
+        # Coalesce odd-sized data (e.g. the tail of a track) into
+        # full periods so that alsa never gets a too-small write
+        accum += data
+        while len(accum) >= period_bytes:
+            self._pcm_put(bytes(accum[:period_bytes]))
+            del accum[:period_bytes]
+
+    def _flush_accum(self):
+        """Queue any remaining sub-period data for writing."""
+        accum = self._accum
+        if accum and self._pcm_queue is not None:
+            self._pcm_queue.put(bytes(accum))
+        del accum[:]
+
+    def playback_delay_seconds(self):
+        """
+        Estimate (``float``, in seconds) of the delay between the
+        decoder position and what the speakers are actually emitting:
+        audio pending in the pcm queue and in the period accumulator,
+        plus the frames still queued in the alsa ring buffer when the
+        pyalsaaudio binding exposes them.
+
+        Useful to get progression reports that do not lead the sound.
+        """
+        play_object = self.play_object
+        if play_object is None or not play_object.sample_rate:
+            return 0.0
+        n_channels, _, chunk_size, _ = self._output_params
+        pending_frames = 0
+        pcm_queue = self._pcm_queue
+        if pcm_queue is not None and chunk_size:
+            pending_frames += pcm_queue.qsize() * chunk_size
+        pending_frames += len(self._accum) // (2 * (n_channels or 1))
+        output = self.output
+        if output is not None and hasattr(output, 'avail') and chunk_size:
+            # Ring buffer size (2 periods, as requested at PCM
+            # creation in _do_open_output) minus the available room
+            # is what alsa still has to play
+            try:
+                pending_frames += max(0, 2 * chunk_size - output.avail())
+            except aa.ALSAAudioError:
+                pass
+        return pending_frames / float(play_object.sample_rate)
+
+    def _apply_pending_volume(self):
+        """
+        Push the last requested volume to the alsa mixer if it changed.
+        """
+        volume = self._pending_volume
+        if volume is not None and volume != self._applied_volume:
+            self.mixer.setvolume(volume)
+            self._applied_volume = volume
 
     def _do_set_volume(self, volume):
         """
         Set the audio volume.
         (Called by :meth:`set_volume`)
 
+        The mixer setvolume() call is a syscall that may block, so
+        while playing it is deferred to the writer thread which applies
+        it between two periods.
+
         :param volume: ``int`` between 0 and 100.
         """
-        self.mixer.setvolume(volume)
+        self._pending_volume = volume
+        if self._writer_thread is None:
+            # Not playing: apply synchronously
+            self._apply_pending_volume()
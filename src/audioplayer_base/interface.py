@@ -1,13 +1,20 @@
 
 import sys
 import os
-from os.path import join, splitext
+from os.path import join
+import json
+import heapq
 from time import time, sleep
 import shutil
 import re
-from threading import Thread, RLock
+from threading import Thread, RLock, Event
 import random
 import traceback
+try:
+    from queue import Queue
+except ImportError:
+    # Python < 3
+    from Queue import Queue
 
 __all__ = ('PlayObjectInterface', 'AudioPlayerInterface',
            'FadeInThread', 'SleepTimerThread')
@@ -17,14 +24,36 @@ if sys.version_info >= (3,):
 
 
 class PrintLogger(object):
+    #: Messages below this level are dropped before any formatting
+    #: happens (same numeric scale as the stdlib ``logging`` levels).
+    #: The default of 0 prints everything, as before.
+    level = 0
+
     def __init__(self, name):
         self.name = name
 
-    def _log_func(self, *args):
-        if len(args) > 1:
-            print(self.name + ' ' + (args[0] % args[1:]))
-        else:
-            print(self.name + ' ' + str(args[0]))
+    def isEnabledFor(self, level):
+        """Same contract as ``logging.Logger.isEnabledFor``."""
+        return level >= self.level
+
+    def _make_log_func(level):
+        def _log_func(self, *args):
+            if level < self.level:
+                # Fast no-op: the caller passes the format string and
+                # its arguments separately, so nothing is built here
+                return
+            if len(args) > 1:
+                print(self.name + ' ' + (args[0] % args[1:]))
+            else:
+                print(self.name + ' ' + str(args[0]))
+        return _log_func
+
+    debug = _make_log_func(10)
+    info = _make_log_func(20)
+    warning = _make_log_func(30)
+    error = _log_func = _make_log_func(40)
+    critical = _make_log_func(50)
+    del _make_log_func
 
     def _log_exception(self, *args):
         _, ex, tb = sys.exc_info()
@@ -33,7 +62,6 @@ class PrintLogger(object):
         if args:
             self._log_func(args)
 
-    debug = info = warning = error = critical = _log_func
     exception = _log_exception
 
 
@@ -54,11 +82,148 @@ except ImportError:
     monotonic = time
 
 
+try:
+    from os import scandir
+except ImportError:
+    # Python < 3.5
+    scandir = None
+
+
 def is_stream(path):
     """Returns whether the given path is a stream."""
     return "://" in path
 
 
+def _compile_search_pattern(pattern):
+    """Compile a case-insensitive search pattern."""
+    return re.compile(pattern, re.IGNORECASE)
+
+try:
+    from functools import lru_cache
+except ImportError:
+    # Python 2: rely on the re module internal cache only
+    pass
+else:
+    # Incremental searches (a UI issuing a query per keystroke)
+    # recompile the same patterns over and over: memoize them
+    _compile_search_pattern = lru_cache(maxsize=64)(_compile_search_pattern)
+
+
+def _iter_audio_entries(root, extensions):
+    """
+    Recursively yield an ``os.DirEntry`` for each file under ``root``
+    whose extension is in ``extensions``.
+
+    Based on :func:`os.scandir`, so a directory listing is a single
+    getdents-served call and the file/dir distinction comes for free
+    from the dirent type, without one extra stat per entry as
+    :func:`os.walk` does.
+    """
+    # A frozenset of lowercased suffixes makes the per-file check a
+    # single hash probe (instead of scanning the suffix tuple), keeps
+    # it O(1) however many extensions a subclass declares, and matches
+    # files with upper-case extensions too
+    suffixes = extensions if isinstance(extensions, frozenset) \
+        else frozenset(e.lower() for e in extensions)
+    try:
+        entries = scandir(root)
+    except OSError:
+        log.warning("Cannot scan directory %r", root)
+        return
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            continue
+        if is_dir:
+            for sub_entry in _iter_audio_entries(entry.path, suffixes):
+                yield sub_entry
+        else:
+            name = entry.name
+            dot = name.rfind('.')
+            if dot >= 0 and name[dot:].lower() in suffixes:
+                yield entry
+
+
+def iter_audio_files(root, extensions):
+    """
+    Recursively yield the paths of the audio files under ``root``
+    whose extension is in ``extensions``.
+    """
+    if scandir is not None:
+        for entry in _iter_audio_entries(root, extensions):
+            yield entry.path
+    else:
+        suffixes = frozenset(e.lower() for e in extensions)
+        walk_join = join  # hoisted for the per-file loop
+        for walk_root, _, file_names in os.walk(root):
+            for file_name in file_names:
+                dot = file_name.rfind('.')
+                if dot >= 0 and file_name[dot:].lower() in suffixes:
+                    yield walk_join(walk_root, file_name)
+
+
+def scan_audio_files_parallel(root, extensions, n_workers):
+    """
+    Scan like :func:`iter_audio_files`, but with ``n_workers`` threads
+    taking directories from a shared queue, and return the matching
+    paths as a (unordered) list.
+
+    Worth it when the library lives on high-latency storage (NAS,
+    network mounts): the walk is then bound by readdir round-trips,
+    which the workers overlap. On a fast local disk the serial
+    :func:`iter_audio_files` is just as good.
+    """
+    if scandir is None or n_workers < 2:
+        return list(iter_audio_files(root, extensions))
+    suffixes = frozenset(e.lower() for e in extensions)
+    dir_queue = Queue()
+    dir_queue.put(root)
+    results = []
+    add_result = results.append  # list.append is atomic under the GIL
+
+    def worker():
+        get_dir = dir_queue.get
+        put_dir = dir_queue.put
+        dir_done = dir_queue.task_done
+        while True:
+            d = get_dir()
+            if d is None:
+                break
+            try:
+                entries = scandir(d)
+            except OSError:
+                log.warning("Cannot scan directory %r", d)
+                dir_done()
+                continue
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_dir:
+                    put_dir(entry.path)
+                else:
+                    name = entry.name
+                    dot = name.rfind('.')
+                    if dot >= 0 and name[dot:].lower() in suffixes:
+                        add_result(entry.path)
+            dir_done()
+
+    threads = []
+    for _ in xrange(n_workers):
+        t = Thread(target=worker)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    # Every queued directory accounts for one task_done: when the
+    # count drops to zero no worker can enqueue anything new either
+    dir_queue.join()
+    for t in threads:
+        dir_queue.put(None)
+    return results
+
+
 class PlayObjectInterface(object):
     """
     Interface class to implement for play objects.
@@ -116,6 +281,21 @@ class PlayObjectInterface(object):
         """
         raise NotImplementedError
 
+    def readframes_into(self, buf, n_frames):
+        """
+        Read up to ``n_frames`` into the given writable buffer
+        (a ``bytearray`` or writable ``memoryview``) and return the
+        number of bytes written.
+
+        This default implementation falls back to :meth:`.readframes`;
+        decoders should override it to fill the buffer directly and
+        avoid allocating a fresh ``bytes`` per chunk.
+        """
+        data = self.readframes(n_frames)
+        n_bytes = len(data)
+        buf[:n_bytes] = data
+        return n_bytes
+
     def close(self):
         """
         Close the play objects (some resources to release ? ...)
@@ -149,6 +329,13 @@ class AudioPlayerInterface(object):
     #: (``int``) Size of audio chunks (number of frames), such as 4096.
     audio_chunk_size = 4096
 
+    #: (``int``) Number of chunks that a :meth:`._do_write_data_chunk`
+    #: implementation may still be holding when it returns (e.g. the
+    #: alsa player's pcm queue). Used to size the pool of reusable
+    #: read buffers so a buffer is never overwritten while still
+    #: pending towards the output.
+    write_pipeline_depth = 0
+
     #: Set this to a valid play object class implementing the
     #: :class:`PlayObjectInterface` interface.
     PlayObjectClass = None
@@ -162,6 +349,22 @@ class AudioPlayerInterface(object):
     #: playback from a sleep timer.
     sleep_timer_wait_track_end = False
 
+    #: Optional path (`str`) of a JSON file caching the full scan of
+    #: :attr:`.default_files_dir` (for example
+    #: ``~/.cache/audio_player/scan.json``), so that playing the whole
+    #: library does not re-walk the tree at every startup.
+    #: The cache is invalidated when the root directory mtime changes
+    #: (touch the root directory to force a rescan).
+    #: ``None`` (the default) disables the cache.
+    scan_cache_file = None
+
+    #: (``int``) Number of threads used for full library scans
+    #: (see :func:`scan_audio_files_parallel`). Values below 2 keep
+    #: the serial scan; raising it pays off when
+    #: :attr:`.default_files_dir` is on high-latency storage such as
+    #: a network mount.
+    scan_workers = 0
+
     def __init__(self,
                  default_files_dir='.',
                  removed_files_backup_dir=None,
@@ -169,11 +372,19 @@ class AudioPlayerInterface(object):
                  notify_progression_interval=None):
         # Using a re-entrant lock instead of simple lock to be able
         # to have nested "with self._lock" without be blocked
-        # (the code is a little bit more short and clear)
+        # (the code is a little bit more short and clear).
+        # Note: the re-entrancy is real, a plain Lock would deadlock:
+        # play() -> set_sleep_timer(), stop() -> stop_volume_fade(),
+        # remove_current() -> play_next(), play_pause() -> play() ...
         self._lock = RLock()
 
         #: (`str`) the default directory to find audio files
         self.default_files_dir = os.path.abspath(default_files_dir)
+        # Precomputed "<default_files_dir><sep>" prefix: deriving a
+        # relative path becomes a startswith + constant-time slice
+        # instead of os.path.relpath, and the trailing separator
+        # avoids false matches on sibling dirs (e.g. "/music2")
+        self._default_files_prefix = self.default_files_dir + os.sep
         #: (`str`) the backup directory where to place the audio files that are
         #: removed by :meth:`.remove_current`.
         if removed_files_backup_dir:
@@ -195,14 +406,44 @@ class AudioPlayerInterface(object):
         # (`str`) the last played music, after a stop
         self._stopped_music = None
 
+        # Backup folders already created by remove_current, so
+        # repeated removals to the same folder skip the exists/makedirs
+        self._known_backup_dirs = set()
+
         self._play_thread = None
         self._sleep_timer_thread = None
         self._fade_thread = None
 
+        # Prefetch of the next track's play object, so that the open
+        # (container probing, decoder setup ...) is already done when
+        # the track transition happens
+        self._prefetch_thread = None
+        self._prefetched = None  # (path, play_object) or None
+
         self._seek = None
         self._go_prev = False
         self._go_next = False
 
+        # In-memory result of the last full scan, as a
+        # (root_dir, root mtime, files) tuple: repeat "play all" /
+        # search queries reuse it instead of re-walking the disk
+        # (see _load_scan_cache)
+        self._scan_memo = None
+
+        # Next queue position to draw when lazily shuffling,
+        # or None when the queue is not shuffled (see play())
+        self._shuffle_pos = None
+
+        # Last (path, formatted display name) pair, to avoid
+        # re-formatting the same name on every UI poll of
+        # :attr:`.current_display_name`
+        self._display_name_cache = (None, '')
+
+        # Cleared while paused: the play loop waits on it instead of
+        # polling the status, and play_pause()/stop() wake it up
+        self._resume_event = Event()
+        self._resume_event.set()
+
         #: (`bool`) Whether the audio must be downmixed to mono (the flag
         #: will be passed to the :meth:`.PlayObjectClass.open` method).
         self.mono = mono
@@ -230,42 +471,59 @@ class AudioPlayerInterface(object):
         Current playing music file (`str` or `None`).
         If it's a web stream, the stream url is returned.
         """
-        with self._lock:
-            if self.status in ("playing", "paused"):
-                try:
-                    current = self.queue[self._play_index]
-                except IndexError:
-                    current = None
-                else:
-                    if isinstance(current, tuple):
-                        # for a radio it can be (name, url), so let's return
-                        # the real path in all cases
-                        current = current[1]
-            else:
+        # Pure reader: snapshot the attributes into locals instead of
+        # taking the lock (single reference reads are atomic, and a
+        # stale value is as good as one read under the lock)
+        status = self.status
+        queue = self.queue
+        play_index = self._play_index
+        if status in ("playing", "paused"):
+            try:
+                current = queue[play_index]
+            except IndexError:
                 current = None
-            return current
+            else:
+                if isinstance(current, tuple):
+                    # for a radio it can be (name, url), so let's return
+                    # the real path in all cases
+                    current = current[1]
+        else:
+            current = None
+        return current
 
     @property
     def current_display_name(self):
         """
         Display name of the current playing music file (`str`)
         """
-        with self._lock:
-            if self.status in ("playing", "paused"):
-                try:
-                    current = self.queue[self._play_index]
-                except IndexError:
-                    name = ""
+        # Pure reader: no lock needed (see the `current` property)
+        status = self.status
+        queue = self.queue
+        play_index = self._play_index
+        if status in ("playing", "paused"):
+            try:
+                current = queue[play_index]
+            except IndexError:
+                name = ""
+            else:
+                if isinstance(current, tuple):
+                    # for a radio it can be (name, url), so let's return
+                    # the name to display instead of the url
+                    name = current[0]
                 else:
-                    if isinstance(current, tuple):
-                        # for a radio it can be (name, url), so let's return
-                        # the name to display instead of the url
-                        name = current[0]
+                    # UIs tend to poll this at a high rate while the
+                    # track does not change: memoize the last
+                    # formatted name (single reference assignment,
+                    # so no lock is needed here either)
+                    cached_path, cached_name = self._display_name_cache
+                    if current == cached_path:
+                        name = cached_name
                     else:
                         name = self.format_music_filename(current)
-            else:
-                name = ""
-            return name
+                        self._display_name_cache = (current, name)
+        else:
+            name = ""
+        return name
 
     def format_music_filename(self, path):
         """
@@ -274,9 +532,16 @@ class AudioPlayerInterface(object):
         if is_stream(path):
             return path
         # local file
-        if path.startswith(self.default_files_dir):
-            path = os.path.relpath(path, self.default_files_dir)
-        return os.path.splitext(path)[0]
+        prefix = self._default_files_prefix
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+        # Drop the extension with a plain rfind/slice: splitext builds
+        # a 2-tuple per call and this runs on every UI poll
+        # (the + 1 keeps splitext's behaviour for dot-files)
+        dot = path.rfind('.')
+        if dot > path.rfind(os.sep) + 1:
+            path = path[:dot]
+        return path
 
     def play(self, path=None, queue=None, loop=False,
              shuffle=False, fade_in=False, sleep_timer=60):
@@ -300,29 +565,28 @@ class AudioPlayerInterface(object):
             self._last_play_args = (
                 [path], dict(loop=loop, shuffle=shuffle, fade_in=fade_in))
 
+            first_track_pinned = False
+
             if queue is not None:
-                # we give a list of files to play
-                self.queue = queue
+                # we give a list of files to play.
+                # Take a copy: shuffling must not mutate the caller's
+                # list, and this also accepts tuples or generators
+                self.queue = list(queue)
                 if not self.queue:
                     log.error("empty queue !")
                     return
-                elif shuffle:
-                    log.info("Shuffling queue")
-                    random.shuffle(self.queue)
             elif os.path.isdir(path):
                 # Folder of music
                 self.queue = self._search('*', root_dir=path)
                 if not self.queue:
                     log.error("empty queue !")
                     return
-                elif shuffle:
-                    log.info("Shuffling queue")
-                    random.shuffle(self.queue)
 
                 if self._stopped_music:
                     # try to play the last stopped music first
                     if os.path.isfile(self._stopped_music):
                         self.queue.insert(0, self._stopped_music)
+                        first_track_pinned = True
                     else:
                         # TODO: handle case when self._stopped_music
                         #       is a tuple/radio
@@ -332,6 +596,20 @@ class AudioPlayerInterface(object):
             else:
                 # single file (or playlist file)
                 self.queue = [path]
+                shuffle = False
+
+            if shuffle:
+                # Lazy Fisher-Yates: instead of shuffling the whole
+                # queue up front (O(library) RNG calls even if only a
+                # few tracks end up being played), each position is
+                # drawn when the play loop reaches it (see
+                # _do_play_queue). _shuffle_pos is the next position
+                # to draw; position 0 stays pinned when the last
+                # stopped music was just re-inserted there.
+                log.info("Shuffling queue (lazily)")
+                self._shuffle_pos = 1 if first_track_pinned else 0
+            else:
+                self._shuffle_pos = None
 
             self.status = "playing"
             self._play_index = 0
@@ -341,6 +619,23 @@ class AudioPlayerInterface(object):
 
             self.set_sleep_timer(sleep_timer)
 
+    def _draw_shuffled_position(self, index):
+        """
+        Lazy shuffle draw (see :meth:`.play`): swap the given queue
+        position with a random not-yet-drawn one, if the queue is
+        shuffled and that position has not been drawn yet.
+        Must be called with :attr:`._lock` held; the play loop of
+        every player implementation calls it before reading a track
+        path from the queue.
+        """
+        shuffle_pos = self._shuffle_pos
+        if (shuffle_pos is not None and
+                shuffle_pos <= index < len(self.queue)):
+            j = random.randrange(index, len(self.queue))
+            self.queue[index], self.queue[j] = \
+                self.queue[j], self.queue[index]
+            self._shuffle_pos = index + 1
+
     def _do_play_queue(self):
         """
         Play the audio queue. (Called in a new thread by :meth:`.play`)
@@ -354,12 +649,25 @@ class AudioPlayerInterface(object):
         self._prev_path = None
 
         open_error_count = 0
+        abort = False
+
+        # Pool of reusable read buffers, rotated across iterations:
+        # allocated once for the whole queue instead of once per chunk
+        # (or even per track), sized so a buffer cannot be rewritten
+        # while a _do_write_data_chunk implementation still holds it
+        # (see write_pipeline_depth)
+        chunk_bytes = 2 * self.audio_chunk_size
+        n_buffers = self.write_pipeline_depth + 2
+        buffers = [bytearray(chunk_bytes)
+                   for _ in xrange(n_buffers)]
+        buf_index = 0
 
         while self.status != "stopped":
             with self._lock:
                 if not self.queue:
                     log.info("Empty queue !")
                     break
+                self._draw_shuffled_position(self._play_index)
                 try:
                     path = self.queue[self._play_index]
                 except IndexError:
@@ -370,16 +678,19 @@ class AudioPlayerInterface(object):
 
             log.info("Will now play %r", path)
             try:
-                self.play_object = play_object = self._do_open_path_for_play(path)
+                play_object = self._take_prefetched(path)
+                if play_object is None:
+                    play_object = self._do_open_path_for_play(path)
+                self.play_object = play_object
             except:
                 log.exception("play object creation failed !")
                 open_error_count += 1
                 if open_error_count > 20:
                     log.error("too much consecutive open failures, stopping player")
-                    # Stop the player in a separate thread so that it can
-                    # join the play thread
-                    Thread(target=self.stop,
-                           kwargs=dict(save_current=False)).start()
+                    # The stop bookkeeping is done inline after the
+                    # loop: calling stop() here would need a helper
+                    # thread, since stop() joins this very thread
+                    abort = True
                     break
                 self._play_index += 1  # try with the next track
                 sleep(2)  # to avoid an endless loop taking all cpu
@@ -388,6 +699,10 @@ class AudioPlayerInterface(object):
             else:
                 # Open worked, let's reset the counter
                 open_error_count = 0
+                # and start opening the next queued track in the
+                # background, so that the transition costs (almost)
+                # nothing when this one finishes
+                self._start_prefetch_next()
 
             if play_object.duration:
                 total_minutes = play_object.duration // 60
@@ -399,24 +714,63 @@ class AudioPlayerInterface(object):
             try:
                 self._do_configure_output_for_current_track()
 
-                log.info("Playing: %s" % (path,))
+                log.info("Playing: %s", path)
 
                 context = {}  # context dict for the current audio track
-                t0 = monotonic()
 
-                if self.notify_progression_interval:
+                # Maintain the playback position by sample counting:
+                # _notify_progression implementations can read
+                # context['pos_sec'] instead of querying the decoder
+                # (get_percentage_pos) on every tick
+                if play_object.sample_rate:
+                    context['pos_sec'] = 0.0
+                    pos_sec_per_byte = 1.0 / (
+                        2.0 * (play_object.num_channels or 1) *
+                        play_object.sample_rate)
+                else:
+                    pos_sec_per_byte = None
+
+                notify_interval = self.notify_progression_interval
+                notify_progression = self._notify_progression
+                if notify_interval:
                     # Call the progression handler just before
                     # reading/playing the first audio chunk
-                    self._notify_progression(context)
-
-                # read the first chunk of audio data
-                data = play_object.readframes(self.audio_chunk_size)
+                    notify_progression(context)
+                    next_notify = monotonic() + notify_interval
+                    # Number of chunks worth of audio per interval:
+                    # the clock only needs to be consulted when the
+                    # deadline can possibly be due
+                    if play_object.sample_rate:
+                        chunks_between = max(1, int(
+                            notify_interval * play_object.sample_rate //
+                            self.audio_chunk_size))
+                    else:
+                        chunks_between = 1
+                    chunk_counter = 0
+
+                # Locals for the steady-state loop body: LOAD_FAST
+                # instead of attribute lookups at chunk rate (the
+                # pure-Python counterpart of compiling the loop; the
+                # mutable control attributes -- status, _seek,
+                # _go_prev/_go_next -- must of course stay attribute
+                # reads)
+                audio_chunk_size = self.audio_chunk_size
+                readframes_into = play_object.readframes_into
+                write_data_chunk = self._do_write_data_chunk
+
+                # Read the first chunk of audio data. The rotation
+                # index is kept across tracks: buffers of the previous
+                # track may still be queued downstream
+                buf = buffers[buf_index]
+                n_read = readframes_into(buf, audio_chunk_size)
+                data = memoryview(buf)[:n_read]
 
                 while data:
                     if self.status == "paused":
                         play_object.set_paused(True)
-                        while self.status == "paused":
-                            sleep(0.05)
+                        # Sleep until play_pause()/stop() wakes us up
+                        # (no periodic polling while paused)
+                        self._resume_event.wait()
                         if self.status == "playing":
                             play_object.set_paused(False)
 
@@ -429,31 +783,57 @@ class AudioPlayerInterface(object):
                     # the progression (for example to update a progress bar)
                     # (not if there is a pending seek which will be
                     # processed just after)
-                    if self.notify_progression_interval and self._seek is None:
-                        t1 = monotonic()
-                        if t1 - t0 >= self.notify_progression_interval:
-                            t0 = t1
-                            self._notify_progression(context)
+                    if notify_interval and self._seek is None:
+                        chunk_counter += 1
+                        if chunk_counter >= chunks_between:
+                            t1 = monotonic()
+                            if t1 >= next_notify:
+                                chunk_counter = 0
+                                next_notify = t1 + notify_interval
+                                notify_progression(context)
 
                     # Write the audio chunk to the audio output.
                     # This method can also be overriden to process the
                     # audio chunk, for example to compute a power spectrum
                     # using FFT
-                    self._do_write_data_chunk(data, context)
-
-                    # Detect possible requested seek
-                    with self._lock:
-                        if self._seek is not None:
-                            seek = self._seek
-                            self._seek = None
-                            try:
-                                log.info("seek detected: %r", seek)
-                                play_object.set_percentage_pos(seek)
-                            except:
-                                log.exception("seek exception")
-
-                    # Read next chunk of data from music
-                    data = play_object.readframes(self.audio_chunk_size)
+                    write_data_chunk(data, context)
+
+                    if pos_sec_per_byte:
+                        context['pos_sec'] += n_read * pos_sec_per_byte
+
+                    # Detect possible requested seek.
+                    # Reading and resetting the attribute is atomic
+                    # enough (a single reference assignment): no need
+                    # to take the lock on every chunk, which would
+                    # stall this loop whenever a caller holds it
+                    seek = self._seek
+                    if seek is not None:
+                        self._seek = None
+                        try:
+                            log.info("seek detected: %r", seek)
+                            play_object.set_percentage_pos(seek)
+                        except:
+                            log.exception("seek exception")
+                        else:
+                            # Discard audio buffered ahead of the
+                            # new position so the seek is heard
+                            # immediately
+                            self._do_flush_output()
+                            if pos_sec_per_byte and play_object.duration:
+                                # Re-anchor the sample-counter
+                                # position (the only time the decoder
+                                # needs to be asked)
+                                pos = play_object.get_percentage_pos()
+                                if pos is not None:
+                                    context['pos_sec'] = (
+                                        pos * play_object.duration / 100.0)
+
+                    # Read next chunk of data from music, into the
+                    # next buffer of the pool
+                    buf_index = (buf_index + 1) % n_buffers
+                    buf = buffers[buf_index]
+                    n_read = readframes_into(buf, audio_chunk_size)
+                    data = memoryview(buf)[:n_read]
 
             except StopIteration:
                 # play_object.readframes has certainly raised this because it
@@ -478,7 +858,18 @@ class AudioPlayerInterface(object):
 
             self._prev_path = path
 
+        if abort:
+            # Same bookkeeping as stop(save_current=False), minus the
+            # join of the play thread (we are the play thread)
+            with self._lock:
+                self.stop_volume_fade()
+                self._stopped_music = None
+                self._do_stop()
+                self.status = "stopped"
+                self.set_sleep_timer(None)
+
         log.debug("end of queue")
+        self._discard_prefetched()
         self._do_close_output()
         log.debug("Status after end of queue: %r", self.status)
         self._on_playback_stopped()
@@ -504,6 +895,15 @@ class AudioPlayerInterface(object):
         # self.output.close()
         # self.output = None
 
+    def _do_flush_output(self):
+        """
+        Discard any audio already buffered towards the output
+        (called by :meth:`._do_play_queue` after a successful seek,
+        so that the new position is heard without first draining the
+        previously buffered audio).
+        """
+        pass
+
     def _do_open_path_for_play(self, path):
         """
         Open a file path or a stream for a play
@@ -517,6 +917,69 @@ class AudioPlayerInterface(object):
         play_object.open(path, mono=self.mono)
         return play_object
 
+    def _start_prefetch_next(self):
+        """
+        Open the next queued track in a background thread
+        (called by :meth:`._do_play_queue` once the current track
+        has been successfully opened).
+        """
+        with self._lock:
+            # Draw the next shuffled position now (advancing the lazy
+            # shuffle), otherwise the draw done at the transition
+            # would pick a different track and the prefetched object
+            # would (almost) always be discarded
+            self._draw_shuffled_position(self._play_index + 1)
+            try:
+                next_path = self.queue[self._play_index + 1]
+            except IndexError:
+                return
+        if isinstance(next_path, tuple) or is_stream(next_path):
+            # Do not open web streams in advance (a radio may close
+            # idle connections, and reopening is cheap anyway)
+            return
+
+        def prefetch():
+            try:
+                play_object = self._do_open_path_for_play(next_path)
+            except:
+                log.exception("prefetch of %r failed", next_path)
+                play_object = None
+            with self._lock:
+                self._prefetched = (next_path, play_object)
+
+        self._prefetch_thread = t = Thread(target=prefetch)
+        t.daemon = True
+        t.start()
+
+    def _take_prefetched(self, path):
+        """
+        Return the prefetched play object if it matches the given path,
+        else ``None`` (closing an obsolete prefetched object if any).
+        """
+        t = self._prefetch_thread
+        if t is not None:
+            # The prefetch normally finishes long before the current
+            # track does, so this join is (almost) always immediate
+            t.join()
+            self._prefetch_thread = None
+        with self._lock:
+            prefetched, self._prefetched = self._prefetched, None
+        if prefetched is None:
+            return None
+        prefetched_path, play_object = prefetched
+        if prefetched_path == path:
+            return play_object
+        # A play_next/play_prev/seek changed the expected track
+        if play_object is not None:
+            log.debug("discarding obsolete prefetched track %r",
+                      prefetched_path)
+            play_object.close()
+        return None
+
+    def _discard_prefetched(self):
+        """Drop (and close) any pending prefetched play object."""
+        self._take_prefetched(None)
+
     def _do_write_data_chunk(self, data, context):
         """
         Directly writes given data to the alsa output.
@@ -525,11 +988,34 @@ class AudioPlayerInterface(object):
         You can also do whatever you want with the data that was just
         written to the audio output, such as an FFT analysis.
 
+        Implementations may return before the data has actually been
+        written to the hardware (e.g. by queueing it to a writer
+        thread, as the alsa player does): the play loop then decodes
+        the next chunk while the previous ones are being played, which
+        hides decode and network latency behind the output buffering.
+
         :param context: A play context ``dict`` that is specific
             to the current played track.
         """
         # self.output.write(data)
 
+    def _chunk_as_samples(self, data):
+        """
+        Return the given audio chunk as a zero-copy numpy ``int16``
+        array of shape (n_frames, num_channels), for implementations
+        of :meth:`._do_write_data_chunk` doing FFT or other analysis.
+
+        Keep the ``int16`` dtype when possible (``numpy.fft`` upcasts
+        internally as needed): an explicit float32/float64 conversion
+        would only multiply the memory traffic, the source audio is
+        16-bit anyway. Requires numpy.
+        """
+        import numpy
+        play_object = self.play_object
+        n_channels = (play_object.num_channels or 1) if play_object else 1
+        return numpy.frombuffer(data, dtype=numpy.int16) \
+            .reshape(-1, n_channels)
+
     def _notify_progression(self, context):
         """
         Handler regularly called during the playback.
@@ -541,7 +1027,12 @@ class AudioPlayerInterface(object):
         which is called in the playback thread).
 
         :param context: A play context ``dict`` that is specific
-            to the current played track.
+            to the current played track. When the track sample rate is
+            known it contains a ``'pos_sec'`` entry: the current
+            position in seconds, maintained by sample counting, so
+            implementations do not need to query the decoder
+            (:meth:`.PlayObjectInterface.get_percentage_pos`) on
+            every tick.
         """
         pass
 
@@ -571,6 +1062,8 @@ class AudioPlayerInterface(object):
                 self._stopped_music = self.current if save_current else None
                 self._do_stop()
                 self.status = "stopped"
+                # Wake up the play thread if it was paused
+                self._resume_event.set()
 
             self.set_sleep_timer(None)
 
@@ -606,6 +1099,10 @@ class AudioPlayerInterface(object):
                 self._do_play_pause()
                 self.status = ("paused" if self.status == "playing"
                                else "playing")
+                if self.status == "paused":
+                    self._resume_event.clear()
+                else:
+                    self._resume_event.set()
 
     def _do_play_pause(self):
         """
@@ -754,18 +1251,49 @@ class AudioPlayerInterface(object):
                             "removed_files_backup_dir. "
                             "Do not delete the file.")
 
-                    if current.startswith(self.default_files_dir):
-                        rel_path = os.path.relpath(current,
-                                                   self.default_files_dir)
+                    prefix = self._default_files_prefix
+                    if current.startswith(prefix):
+                        rel_path = current[len(prefix):]
                     else:
                         rel_path = current
                         if current.startswith('/') or current.startswith('\\'):
                             rel_path = current[1:]
                     target_file = join(self.removed_files_backup_dir, rel_path)
                     target_folder = os.path.dirname(target_file)
-                    if not os.path.exists(target_folder):
-                        os.makedirs(target_folder)
-                    shutil.move(current, target_file)
+                    if target_folder not in self._known_backup_dirs:
+                        try:
+                            # No exists() pre-check: just try, and let
+                            # an already-existing dir pass (saves a
+                            # stat; a real permission problem will
+                            # surface in the rename below anyway)
+                            os.makedirs(target_folder)
+                        except OSError:
+                            pass
+                        self._known_backup_dirs.add(target_folder)
+                    rename = getattr(os, 'replace', os.rename)
+                    try:
+                        # Single rename syscall when the backup dir is
+                        # on the same filesystem
+                        rename(current, target_file)
+                    except OSError:
+                        # Probably a cross-filesystem move: that is a
+                        # full copy + unlink, do it in the background
+                        # so the caller is not stalled for seconds on
+                        # slow media
+                        log.debug("moving %r to the backup dir in a "
+                                  "background thread", current)
+
+                        def move_in_background(src=current,
+                                               dst=target_file):
+                            try:
+                                shutil.move(src, dst)
+                            except (OSError, shutil.Error):
+                                log.exception("backup move of %r failed",
+                                              src)
+
+                        t = Thread(target=move_in_background)
+                        t.daemon = True
+                        t.start()
                 else:
                     os.remove(current)
             except OSError as e:
@@ -803,7 +1331,7 @@ class AudioPlayerInterface(object):
         Search musics given a string pattern (regex) and play results if any
         """
         pattern = pattern.strip()
-        log.info("search_and_play: %r" % pattern)
+        log.info("search_and_play: %r", pattern)
         queue = self._search(pattern)
         if not queue:
             log.warning("No results for %r pattern! Don't play", pattern)
@@ -835,10 +1363,15 @@ class AudioPlayerInterface(object):
 
         if not pattern or pattern == '*':
             log.info("Search all files in %r", root_dir)
-            queue = [join(root, file_name)
-                     for root, _, file_names in os.walk(root_dir)
-                     for file_name in file_names
-                     if splitext(file_name)[1] in handled_extensions]
+            queue = self._load_scan_cache(root_dir)
+            if queue is None:
+                if self.scan_workers > 1:
+                    queue = scan_audio_files_parallel(
+                        root_dir, handled_extensions, self.scan_workers)
+                else:
+                    queue = list(iter_audio_files(root_dir,
+                                                  handled_extensions))
+                self._save_scan_cache(root_dir, queue)
 
         elif is_stream(pattern):
             # play a web stream
@@ -851,12 +1384,34 @@ class AudioPlayerInterface(object):
             if key == "#recent":
                 # special '#recent' query allowing to play all files ordered by
                 # modification date (descending)
-                queue = [join(root, file_name)
-                         for root, _, file_names
-                         in os.walk(self.default_files_dir)
-                         for file_name in file_names
-                         if splitext(file_name)[1] in handled_extensions]
-                queue.sort(key=os.path.getmtime, reverse=True)
+                if scandir is not None:
+                    # DirEntry.stat() is served from the directory
+                    # scan, so collecting the mtime here avoids
+                    # re-stating every file in the sort key
+                    def iter_mtime_pairs():
+                        for entry in _iter_audio_entries(
+                                self.default_files_dir,
+                                handled_extensions):
+                            try:
+                                yield (entry.stat().st_mtime, entry.path)
+                            except OSError:
+                                # the file disappeared during the scan
+                                pass
+                    if options.isdigit():
+                        # Only the N most recent files are wanted:
+                        # feeding the iterator to a partial sort keeps
+                        # both CPU (O(n log N)) and memory (O(N))
+                        # bounded, instead of materializing and
+                        # sorting the whole library
+                        pairs = heapq.nlargest(int(options),
+                                               iter_mtime_pairs())
+                    else:
+                        pairs = sorted(iter_mtime_pairs(), reverse=True)
+                    queue = [path for _, path in pairs]
+                else:
+                    queue = list(iter_audio_files(self.default_files_dir,
+                                                  handled_extensions))
+                    queue.sort(key=os.path.getmtime, reverse=True)
                 log.debug("queue sorted by modification date")
             else:
                 log.error("Unknown special '#' query %r", pattern)
@@ -870,23 +1425,116 @@ class AudioPlayerInterface(object):
 
         else:
             # Normal search with given pattern on local files
-            match = re.match
             queue = []
             add = queue.append
 
-            regexp = re.compile("^.*" + pattern, re.IGNORECASE)
-
-            for root, _, file_names in os.walk(self.default_files_dir):
-                for file_name in file_names:
-                    if splitext(file_name)[1] not in handled_extensions:
+            # Serve the walk from the in-memory scan result when it is
+            # still fresh: repeat searches then only cost the filter
+            all_files = self._load_scan_cache(self.default_files_dir)
+            if all_files is None:
+                all_files = iter_audio_files(self.default_files_dir,
+                                             handled_extensions)
+
+            if not re.search(r'[.^$*+?{}\[\]|()\\]', pattern):
+                # No regex metacharacter: the pattern is equivalent to
+                # a case-insensitive substring test, which is much
+                # faster than the regex engine
+                needle = pattern.lower()
+                for full_path in all_files:
+                    if needle in full_path.lower():
+                        add(full_path)
+            else:
+                # re.search makes the old "^.*" prefix useless
+                search = _compile_search_pattern(pattern).search
+                # Longest literal run of the pattern, used as a cheap
+                # substring prefilter: a C-level `in` test rejects
+                # most paths without entering the regex engine. Only
+                # sound for simple shapes (no groups, classes,
+                # alternation or quantified literals, which could make
+                # the run optional), e.g. 'artist.*title'
+                literal = ''
+                if not re.search(r'[\[\](){}|?\\]', pattern) and \
+                        not re.search(r'[^.][*+]', pattern):
+                    literals = re.findall(r'[A-Za-z0-9 _-]+', pattern)
+                    if literals:
+                        literal = max(literals, key=len).lower()
+                    if len(literal) < 3:
+                        # too short to be selective
+                        literal = ''
+                for full_path in all_files:
+                    if literal and literal not in full_path.lower():
                         continue
-                    full_path = join(root, file_name)
-                    if match(regexp, full_path):
+                    if search(full_path):
                         add(full_path)
 
-        log.info("Found %s results in %ss" % (len(queue), time() - t0))
+        log.info("Found %s results in %ss", len(queue), time() - t0)
         return queue
 
+    def _load_scan_cache(self, root_dir):
+        """
+        Return the cached full-scan file list for the given root
+        directory, or ``None`` if no fresh cached result exists.
+
+        Looks first at the in-memory result of the previous scan, then
+        at the optional persistent cache (:attr:`.scan_cache_file`).
+        Both are invalidated when the root directory mtime changes.
+        """
+        try:
+            root_mtime = os.path.getmtime(root_dir)
+        except OSError:
+            return None
+        memo = self._scan_memo
+        if (memo is not None and
+                memo[0] == root_dir and memo[1] == root_mtime):
+            log.debug("Using in-memory scan result (%s files)",
+                      len(memo[2]))
+            # copy: the caller's queue is mutated (shuffle, insert...)
+            return list(memo[2])
+        cache_file = self.scan_cache_file
+        if not cache_file:
+            return None
+        try:
+            with open(cache_file) as f:
+                cached = json.load(f)
+            if (cached['root'] == root_dir and
+                    cached['mtime'] == root_mtime):
+                files = cached['files']
+                log.debug("Using scan cache %r (%s files)",
+                          cache_file, len(files))
+                self._scan_memo = (root_dir, root_mtime, files)
+                return list(files)
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def _save_scan_cache(self, root_dir, files):
+        """
+        Keep the full-scan result for the given root directory, in
+        memory and - if enabled - in the :attr:`.scan_cache_file`.
+        """
+        try:
+            root_mtime = os.path.getmtime(root_dir)
+        except OSError:
+            return
+        self._scan_memo = (root_dir, root_mtime, list(files))
+        cache_file = self.scan_cache_file
+        if not cache_file:
+            return
+        try:
+            cache_dir = os.path.dirname(cache_file)
+            if cache_dir:
+                try:
+                    os.makedirs(cache_dir)
+                except OSError:
+                    # already exists
+                    pass
+            with open(cache_file, 'w') as f:
+                json.dump({'root': root_dir,
+                           'mtime': root_mtime,
+                           'files': files}, f)
+        except (IOError, OSError, ValueError):
+            log.exception("Failed to write scan cache %r", cache_file)
+
     def set_sleep_timer(self, duration):
         """
         Start a new sleep timer with given duration in minutes.
@@ -929,16 +1577,47 @@ class PlayThread(Thread):
             raise
 
 
-class FadeInThread(Thread):
+class _StoppableThread(Thread):
+    """
+    Base class for the player helper threads: the ``running`` flag is
+    backed by an :class:`Event`, so setting ``running = False`` wakes
+    the thread immediately instead of letting it finish a multi-second
+    ``sleep``.
+    """
+    def __init__(self):
+        Thread.__init__(self)
+        self._stop_event = Event()
+        self._stop_event.set()  # not running yet
+        self.daemon = True
+
+    @property
+    def running(self):
+        """Whether the thread should keep running. (settable)"""
+        return not self._stop_event.is_set()
+
+    @running.setter
+    def running(self, value):
+        if value:
+            self._stop_event.clear()
+        else:
+            self._stop_event.set()
+
+    def _interruptible_sleep(self, delay):
+        """
+        Wait up to ``delay`` seconds; returns ``True`` (immediately)
+        if ``running`` was set to ``False`` meanwhile.
+        """
+        return self._stop_event.wait(delay)
+
+
+class FadeInThread(_StoppableThread):
     """
     Thread that slowly increases the volume
     """
     def __init__(self, get_volume_func, set_volume_func, max_volume=85):
-        Thread.__init__(self)
-        self.running = False
+        _StoppableThread.__init__(self)
         self.get_volume = get_volume_func
         self.set_volume = set_volume_func
-        self.daemon = True
         self.max_volume = max_volume
 
     def start(self):
@@ -947,35 +1626,32 @@ class FadeInThread(Thread):
 
     def run(self):
         max_vol = self.max_volume
-        get_volume, set_volume = self.get_volume, self.set_volume
-        current_vol = get_volume()
+        set_volume = self.set_volume
+        current_vol = self.get_volume()
         if current_vol >= max_vol:
             log.info("FadeInThread: volume is already higher than target volume")
             return
         increment = 4
-        for vol in xrange(current_vol + increment, max_vol, increment):
-            if get_volume() < vol:
-                set_volume(vol)
-            if not self.running:
-                return
-            sleep(3.5)
-            if not self.running:
+        # Precomputed ramp, applied without volume read-backs: the
+        # fade owns the volume while it runs, so each step is a
+        # single set_volume call
+        steps = list(xrange(current_vol + increment, max_vol, increment))
+        for vol in steps:
+            set_volume(vol)
+            if self._interruptible_sleep(3.5):
                 return
-        if get_volume() < max_vol:
-            set_volume(max_vol)
+        set_volume(max_vol)
 
 
-class FadeOutThread(Thread):
+class FadeOutThread(_StoppableThread):
     """
     Thread that slowly decreases the volume
     """
     def __init__(self, get_volume_func, set_volume_func, stop_func):
-        Thread.__init__(self)
-        self.running = False
+        _StoppableThread.__init__(self)
         self.get_volume = get_volume_func
         self.set_volume = set_volume_func
         self.stop_player = stop_func
-        self.daemon = True
 
     def start(self):
         self.running = True
@@ -983,33 +1659,29 @@ class FadeOutThread(Thread):
 
     def run(self):
         log.debug("FadeOutThread run")
-        get_volume, set_volume = self.get_volume, self.set_volume
-        orig_volume = get_volume()
-        for vol in xrange(orig_volume, 0, -4):
-            if get_volume() > vol:
-                log.debug("FadeOutThread : set_volume(%s)", vol)
-                set_volume(vol)
-            if not self.running:
-                return
-            sleep(0.5)
-            if not self.running:
+        set_volume = self.set_volume
+        orig_volume = self.get_volume()
+        # Precomputed ramp without read-backs (see FadeInThread.run);
+        # the first step skips the no-op set of the current volume
+        steps = list(xrange(orig_volume - 4, 0, -4))
+        for vol in steps:
+            log.debug("FadeOutThread : set_volume(%s)", vol)
+            set_volume(vol)
+            if self._interruptible_sleep(0.5):
                 return
-        if get_volume() > 0:
-            log.debug("FadeOutThread : set_volume(0)")
-            set_volume(0)
+        log.debug("FadeOutThread : set_volume(0)")
+        set_volume(0)
         log.debug("FadeOutThread : stop player")
         self.stop_player(fade_out=False)
         # Restore the initial volume
         set_volume(orig_volume)
 
 
-class SleepTimerThread(Thread):
+class SleepTimerThread(_StoppableThread):
     """Sleep timer (not yet customizable)"""
     def __init__(self, player):
-        Thread.__init__(self)
-        self.running = False
+        _StoppableThread.__init__(self)
         self.player = player
-        self.daemon = True
         # Remaining duration in minutes
         self.remaining = None
 
@@ -1026,27 +1698,49 @@ class SleepTimerThread(Thread):
         if player.sleep_timer_update_handler is not None:
             player.sleep_timer_update_handler(self.remaining)
 
-        nb_iterations = self.remaining
-        for i in xrange(nb_iterations):
-            sleep(60)
+        def tick():
+            """
+            Sleep one minute, update the remaining time and call the
+            sleep timer handler. Returns ``False`` when the timer was
+            aborted.
+            """
+            if self._interruptible_sleep(60):
+                return False
             self.remaining -= 1
-            if not self.running:
-                log.info("leaving aborted %s", self)
-                return
-
-            # Call the player sleep timer handler if any
             if player.sleep_timer_update_handler is not None:
                 player.sleep_timer_update_handler(self.remaining)
+            return True
+
+        nb_iterations = self.remaining
+
+        # First ~75% of the duration: plain sleeping (no fade test
+        # on every minute)
+        nb_sleep_only = min(nb_iterations, int(0.75 * nb_iterations) + 1)
+        for _ in xrange(nb_sleep_only):
+            if not tick():
+                log.info("leaving aborted %s", self)
+                return
 
-            if i > 0.75 * nb_iterations:
-                player.set_volume(max(0, self.player.volume - 1))
+        # Last quarter: ramp the volume down following a precomputed
+        # schedule, skipping the mixer call when the volume would not
+        # change
+        start_volume = player.volume or 0
+        schedule = [max(0, start_volume - 1 - k)
+                    for k in xrange(nb_iterations - nb_sleep_only)]
+        for target_volume in schedule:
+            if not tick():
+                log.info("leaving aborted %s", self)
+                return
+            if target_volume != player.volume:
+                player.set_volume(target_volume)
 
         play_obj = player.play_object
         play_obj_duration = play_obj.duration
         if player.sleep_timer_wait_track_end and play_obj_duration:
             log.info("Sleep timer: waiting current track end")
             while self.running and player.play_object is play_obj:
-                sleep(1)
+                if self._interruptible_sleep(1):
+                    break
                 track_remaining_time = (play_obj_duration -
                                         (play_obj.get_percentage_pos() / 100.0
                                          * play_obj_duration))
@@ -19,13 +19,18 @@ class PyAVPlayObject(PlayObjectInterface):
         super(PyAVPlayObject, self).__init__()
         self.path = None
         self.open_kargs = None
-        self.data = b''
+        # Reusable accumulation buffer: appending decoded planes to a
+        # bytearray is amortized in-place, instead of reallocating an
+        # ever-growing bytes object per frame
+        self.data = bytearray()
         self.last_frame = None
         self.last_frame_pts = 0
         self.decode_iter = None
         self.pos = None
         self.container = None
         self.stream = None
+        # pts -> percentage multiplier, precomputed at open time
+        self._pct_per_pts = None
 
     def open(self, path, mono=False, sample_rate=None):
         """Open the audio resource."""
@@ -71,6 +76,15 @@ class PyAVPlayObject(PlayObjectInterface):
             log.info("No duration")
             self.duration = None
 
+        if self.duration:
+            # Fold the Fraction time_base and the /duration*100 into
+            # one float multiplier: get_percentage_pos is then a
+            # single multiply (it is polled at every progression tick)
+            self._pct_per_pts = \
+                float(stream.time_base) * 100.0 / self.duration
+        else:
+            self._pct_per_pts = None
+
         self.num_channels = 1 if mono else stream.channels
         self.sample_rate = resampler.rate
 
@@ -79,6 +93,29 @@ class PyAVPlayObject(PlayObjectInterface):
         # Special treatments for web streams: reopen the
         # stream when the playback is unpaused
         if is_stream(self.path):
+            container = self.container
+            if (container is not None and
+                    hasattr(container, 'pause') and
+                    hasattr(container, 'resume')):
+                # ffmpeg's av_read_pause/av_read_play (exposed by
+                # some PyAV versions): for protocols supporting it
+                # (RTSP, some live HTTP) this keeps the connection,
+                # saving the DNS + handshake + probe of a full
+                # reopen on every pause cycle
+                try:
+                    if paused:
+                        log.info("Pause stream reading")
+                        container.pause()
+                    else:
+                        log.info("Resume stream reading")
+                        container.resume()
+                except Exception:
+                    log.exception("read pause/play failed, falling "
+                                  "back to a stream reopen")
+                    if not paused:
+                        self.close()
+                else:
+                    return
             if paused:
                 log.info("Close paused stream")
                 self.close()
@@ -95,36 +132,71 @@ class PyAVPlayObject(PlayObjectInterface):
         log.debug("stream.seek took %s", time() - t0)
 
     def get_percentage_pos(self):
-        if self.duration and self.stream is not None:
-            last_pts = self.last_frame_pts
-            self.pos = max(0, min(100, (last_pts * float(self.stream.time_base)
-                                        / self.duration * 100)))
+        pct_per_pts = self._pct_per_pts
+        if pct_per_pts and self.stream is not None:
+            pos = self.last_frame_pts * pct_per_pts
+            self.pos = 0 if pos < 0 else 100 if pos > 100 else pos
         return self.pos
 
-    def readframes(self, n_frames):
+    def _fill_buffer(self, n_bytes):
         """
-        Read data and return exactly n_frames.
-        (So if there is 2 bytes per frame, the result data length will
-        be 2 * n_frames)
+        Decode frames until the accumulation buffer holds at least
+        ``n_bytes``, and return it.
 
         :raises: ``StopIteration`` when play is finished.
         """
-        n_bytes = 2 * n_frames  # 2 bytes per frame
         data = self.data
         while len(data) < n_bytes:
             frame = next(self.decode_iter)
             self.last_frame = frame
-            data += frame.planes[0].to_bytes()
-            if not data:
-                break
-        data, remaining_data = data[:n_bytes], data[n_bytes:]
-        # save the remaining data for the next call
-        self.data = remaining_data
+            plane = frame.planes[0]
+            try:
+                # Planes support the buffer protocol: extend straight
+                # from the decoded samples, skipping the intermediate
+                # bytes object to_bytes() would allocate per frame
+                data += memoryview(plane)
+            except TypeError:
+                data += plane.to_bytes()
+            # An empty plane (seek recovery ...) simply loops for the
+            # next frame; real EOF surfaces as the decode iterator's
+            # StopIteration, never as a silent short read
         return data
 
+    def readframes(self, n_frames):
+        """
+        Read data and return exactly n_frames.
+        (So if there is 2 bytes per frame, the result data length will
+        be 2 * n_frames)
+
+        :raises: ``StopIteration`` when play is finished.
+        """
+        n_bytes = 2 * n_frames  # 2 bytes per frame
+        data = self._fill_buffer(n_bytes)
+        # Extract the chunk as immutable bytes (it may be consumed
+        # asynchronously, so it cannot alias the reused buffer) and
+        # keep the remainder in place
+        chunk = bytes(memoryview(data)[:n_bytes])
+        del data[:n_bytes]
+        return chunk
+
+    def readframes_into(self, buf, n_frames):
+        """
+        Read up to ``n_frames`` into the given writable buffer and
+        return the number of bytes written (allocation-free variant
+        of :meth:`.readframes`).
+
+        :raises: ``StopIteration`` when play is finished.
+        """
+        n_bytes = 2 * n_frames  # 2 bytes per frame
+        data = self._fill_buffer(n_bytes)
+        n = min(n_bytes, len(data))
+        buf[:n] = memoryview(data)[:n]
+        del data[:n]
+        return n
+
     def close(self):
         log.info("Close %s", self)
-        self.data = b''
+        del self.data[:]
         self.decode_iter = None
         self.last_frame = None
         self.stream = None
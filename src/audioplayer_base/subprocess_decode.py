@@ -6,7 +6,6 @@ decoder.py: decoding of mp3, ogg, wma, ... using an external
             -> https://pypi.python.org/pypi/decoder.py/1.5XB
 """
 
-import os
 from time import time
 import wave
 
@@ -62,7 +61,7 @@ class SubprocessDecoderPlayObject(PlayObjectInterface):
         t0 = time()
         x = int(self.audio_file.getnframes() * pos / 100.0)
         self.audio_file.setpos(x)  # needs my workaround in decoder.py
-        print("seek took %s" % (time() - t0,))
+        log.debug("seek took %s", time() - t0)
 
     def get_percentage_pos(self):
         """
@@ -87,5 +86,7 @@ class SubprocessDecoderPlayObject(PlayObjectInterface):
         log.info("Close %s", self)
         self.audio_file.close()
         self.audio_file = None
-        # just a safety, should not be needed
-        os.system("killall -9 %s" % self._decoder_name)
+        # no killall safety net here: the decoder child exits by
+        # itself when its output pipe is closed above, and killall
+        # would fork a shell and kill every decoder process on the
+        # system, not just ours
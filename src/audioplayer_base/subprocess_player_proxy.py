@@ -4,16 +4,12 @@ audio files, such as mplayer.
 """
 
 import os
-import re
-from time import sleep
+import fcntl
+import select
 import subprocess
 import signal
 
-from .interface import log, AudioPlayerInterface, FadeInThread
-
-# NonBlockingStreamReader permits to parse a subprocess stdout
-# without being blocked
-from .nbstreamreader import NonBlockingStreamReader
+from .interface import log, monotonic, AudioPlayerInterface, FadeInThread
 
 __all__ = ('SubprocessAudioPlayer',)
 
@@ -26,10 +22,17 @@ class SubprocessAudioPlayer(AudioPlayerInterface):
     player = "mplayer"
     player_default_options = ['-slave', '-quiet']
 
-    _percent_pos_regex = re.compile(r"ANS_PERCENT_POSITION=(\d+)")
+    # prefix of the answer to _get_pos_cmd, as bytes (the stdout
+    # pipe is binary): parsed with plain string methods, no regex
+    _percent_pos_prefix = b'ANS_PERCENT_POSITION='
 
+    # slave-mode commands, as bytes: the stdin pipe is binary
+    # (bufsize=0), so str literals would be encoded per write on
+    # Python 3 (and fail for the unbuffered pipe)
     _quit_cmd = b'quit\n'
     _pause_cmd = b'pause\n'
+    _get_pos_cmd = b'pausing_keep_force get_percent_pos\n'
+    _seek_cmd = b'seek %d 1\n'
 
     def __init__(self, *args, **kwargs):
         super(SubprocessAudioPlayer, self).__init__(*args, **kwargs)
@@ -55,6 +58,7 @@ class SubprocessAudioPlayer(AudioPlayerInterface):
 
         while self.status != "stopped":
             with self._lock:
+                self._draw_shuffled_position(self._play_index)
                 try:
                     path = self.queue[self._play_index]
                 except IndexError:
@@ -73,6 +77,11 @@ class SubprocessAudioPlayer(AudioPlayerInterface):
                                                             stdout=subprocess.PIPE,
                                                             preexec_fn=os.setsid)
 
+                # next/prev command marker, always present on the
+                # handle so the end-of-track check below is a plain
+                # attribute read (no getattr fallback)
+                p.op = None
+
                 self.status = "playing"
                 log.info("Play of %r is launched !", path)
                 self.sleep_tag = None  # we will set it to True/False later
@@ -82,32 +91,67 @@ class SubprocessAudioPlayer(AudioPlayerInterface):
                 #                             "current_music_index:%i/%i" % (self._play_index + 1, len(self.queue)),
                 #                             "music_pos:0"))
 
-            # wrap p.stdout with a NonBlockingStreamReader object:
-            nbsr = NonBlockingStreamReader(p.stdout)
+            # Monitor the player through its stdout pipe directly:
+            # select() sleeps until the player writes something (or
+            # until the position-poll deadline), replacing the
+            # previous 50 Hz sleep polling and the reader thread that
+            # NonBlockingStreamReader spawned per track
+            stdout_fd = p.stdout.fileno()
+            flags = fcntl.fcntl(stdout_fd, fcntl.F_GETFL)
+            fcntl.fcntl(stdout_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
 
             position = None
+            pending = b''
+            get_pos_cmd = self._get_pos_cmd
+            write_cmd = p.stdin.write  # hoisted for the monitor loop
+            poll_interval = 0.4
+            next_poll = monotonic() + poll_interval
             while self.current_process is p:
-                for _ in range(20):
-                    if self.current_process is not p:  # None if stopped
-                        break
-                    sleep(0.02)
+                # Sleep until the player writes something, or until
+                # the next position-poll deadline. The rlist result
+                # tells the two wake-up causes apart: querying the
+                # position on every wake-up would make the loop
+                # self-sustaining, as each answer on stdout wakes the
+                # next select immediately
+                rlist = select.select(
+                    [p.stdout], [], [],
+                    max(0.0, next_poll - monotonic()))[0]
+                if self.current_process is not p:  # None if stopped
+                    break
                 try:
-                    # Read all current available stdout from the subprocess
-                    while True:
-                        output = nbsr.readline(0.01)
-                        if not output:
-                            break
-                    # Now we can ask the playing position and send it to the phone
-                    # so that it can update its progress bar
-                    p.stdin.write("pausing_keep_force get_percent_pos\n")
-                    out = nbsr.readline(0.05)
-                    if out:
-                        match = self._percent_pos_regex.search(out)
-                        if match:
-                            pos = int(match.group(1))
-                            if pos != position:
-                                position = pos
-                                # TODO: notify the progression
+                    now = monotonic()
+                    if now >= next_poll:
+                        next_poll = now + poll_interval
+                        # Ask the playing position, so that e.g. a
+                        # progress bar can be updated (the answer is
+                        # drained on a following wake-up)
+                        write_cmd(get_pos_cmd)
+                    if rlist:
+                        try:
+                            out = os.read(stdout_fd, 4096)
+                        except OSError:
+                            # nothing available yet (EAGAIN)
+                            out = b''
+                        if out:
+                            # only parse complete lines, keep the
+                            # tail. A find + slice on the bytes is
+                            # enough to extract the last answer, no
+                            # regex/decoding
+                            lines, _, pending = (pending + out) \
+                                .rpartition(b'\n')
+                            idx = lines.rfind(self._percent_pos_prefix)
+                            if idx >= 0:
+                                idx += len(self._percent_pos_prefix)
+                                end = lines.find(b'\n', idx)
+                                if end < 0:
+                                    end = len(lines)
+                                try:
+                                    pos = int(lines[idx:end])
+                                except ValueError:
+                                    pos = None
+                                if pos is not None and pos != position:
+                                    position = pos
+                                    # TODO: notify the progression
                 except Exception as poll_exc:
                     log.error(poll_exc)
                     break
@@ -125,8 +169,7 @@ class SubprocessAudioPlayer(AudioPlayerInterface):
                     return
                 else:
                     # handle previous/next commands or normal end of current music file
-                    op = getattr(p, "op", None)
-                    if op is None:
+                    if p.op is None:
                         # automatically continue the playlist
                         self._play_index += 1
                     # else op == "prev" or op == "next" and the play index is already shifted
@@ -135,6 +178,22 @@ class SubprocessAudioPlayer(AudioPlayerInterface):
         with self._lock:
             self.status = "stopped"
 
+    def _kill_current(self):
+        """
+        SIGKILL the current player process group (the player is
+        started with setsid, so its group id is its pid). Kills only
+        our own player, without the shell fork and the /proc scan
+        ``killall`` would cost.
+        """
+        p = self.current_process
+        if p is None:
+            return
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except OSError:
+            # already gone
+            pass
+
     def _do_stop(self):
         """ Stop the music, called by :meth:`.stop` """
         # Send the signal to all the process groups
@@ -148,7 +207,7 @@ class SubprocessAudioPlayer(AudioPlayerInterface):
             log.error(e)
         finally:
             # just a safety, should not be needed
-            os.system("killall -9 %s" % self.player)
+            self._kill_current()
 
         self.current_process = None
 
@@ -169,7 +228,7 @@ class SubprocessAudioPlayer(AudioPlayerInterface):
         try:
             # self.current_process.stdin.write("pt_step 1\n")
             self.current_process.stdin.write(self._quit_cmd)
-            os.system("killall -9 %s" % self.player)
+            self._kill_current()
         except Exception as e:
             log.error("Error trying to play next song: %r", e)
             return False
@@ -185,7 +244,7 @@ class SubprocessAudioPlayer(AudioPlayerInterface):
         try:
             # self.current_process.stdin.write("pt_step -1\n")
             self.current_process.stdin.write(self._quit_cmd)
-            os.system("killall -9 %s" % self.player)
+            self._kill_current()
         except Exception as e:
             log.error("Error trying to play previous song: %r", e)
             return False
@@ -195,7 +254,7 @@ class SubprocessAudioPlayer(AudioPlayerInterface):
     def _do_seek(self, val):
         """Seek to the given value, called by :meth:`.seek`"""
         try:
-            self.current_process.stdin.write("seek %s 1\n" % val)
+            self.current_process.stdin.write(self._seek_cmd % val)
         except Exception as e:
             log.error("Error trying to seek: %r", e)
 